@@ -1,31 +1,122 @@
+import hashlib
 import os
+import statistics
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from functools import lru_cache
+from typing import Iterable, Optional, Set
+import bcrypt
 from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from jose import jwt, JWTError
-from passlib.context import CryptContext
+from cachetools import TLRUCache
+import jwt
+from jwt import InvalidTokenError
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from .database import SessionLocal
 from .models import User
 
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_ME_SUPER_SECRET")
 ALGORITHM = "HS256"
+# Disiapkan sekali, tidak dibangun ulang setiap decode
+_SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8")
+_DECODE_ALGORITHMS = (ALGORITHM,)
+_DECODE_OPTS = {"verify_signature": True, "verify_exp": True}
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 8  # 8 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cost bcrypt: BCRYPT_ROUNDS dari env, atau dikalibrasi saat startup (calibrate_bcrypt_rounds).
+# Kalibrasi berjalan per proses → deployment multi-worker sebaiknya mem-pin BCRYPT_ROUNDS
+# agar semua worker (dan hash dummy-nya) memakai cost yang sama.
+BCRYPT_ROUNDS_FROM_ENV = os.getenv("BCRYPT_ROUNDS")
+BCRYPT_DEFAULT_ROUNDS = 12
+BCRYPT_ROUNDS = int(BCRYPT_ROUNDS_FROM_ENV or BCRYPT_DEFAULT_ROUNDS)
+# Kalibrasi tidak boleh di bawah cost hash yang sudah tersimpan (default 12):
+# hash dummy untuk login user tak dikenal harus sama mahalnya dengan hash asli.
+BCRYPT_MIN_ROUNDS = BCRYPT_DEFAULT_ROUNDS
+BCRYPT_MAX_ROUNDS = 14
+BCRYPT_TARGET_SECONDS = 0.25
+_CALIBRATION_ROUNDS = 10  # diukur di cost murah lalu diekstrapolasi
+
+def calibrate_bcrypt_rounds(target_seconds: float = BCRYPT_TARGET_SECONDS) -> int:
+    """
+    Pilih cost bcrypt terbesar (12..14) yang median waktu hash-nya <= target di mesin ini.
+    Cukup diukur di cost 10: tiap +1 round, waktu hash naik 2x.
+    """
+    global BCRYPT_ROUNDS
+    samples = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=_CALIBRATION_ROUNDS))
+        samples.append(time.perf_counter() - t0)
+    base = statistics.median(samples)
+    rounds = BCRYPT_MIN_ROUNDS
+    while rounds < BCRYPT_MAX_ROUNDS and base * 2 ** (rounds + 1 - _CALIBRATION_ROUNDS) <= target_seconds:
+        rounds += 1
+    BCRYPT_ROUNDS = rounds
+    return rounds
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt hanya memakai 72 byte pertama (sama seperti perilaku passlib)
+    return password.encode("utf-8")[:72]
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("ascii")
 
 def verify_password(plain_password: str, password_hash: str) -> bool:
-    return pwd_context.verify(plain_password, password_hash)
+    try:
+        return bcrypt.checkpw(_password_bytes(plain_password), password_hash.encode("ascii"))
+    except ValueError:
+        # hash rusak / bukan format bcrypt
+        return False
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """
+    True jika cost hash tersimpan ($2b$<cost>$...) lebih rendah dari BCRYPT_ROUNDS saat ini.
+    Hanya naik, tidak turun: worker dengan cost kalibrasi berbeda tidak saling menulis ulang hash.
+    """
+    try:
+        return int(password_hash.split("$")[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+def existing_usernames(db: Session, names: Iterable[str]) -> Set[str]:
+    """Username mana saja yang sudah terdaftar: satu SELECT ... IN (...) tanpa hidrasi objek ORM."""
+    names = list(names)
+    if not names:
+        return set()
+    return set(db.execute(select(User.username).where(User.username.in_(names))).scalars())
+
+@lru_cache(maxsize=1)
+def dummy_password_hash() -> str:
+    """
+    Hash bcrypt (cost BCRYPT_ROUNDS) untuk diverifikasi saat username tidak ada → waktu respon setara.
+    Dibangun saat startup setelah kalibrasi, bukan di login pertama.
+    """
+    return get_password_hash("dummy-password-for-timing")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, _SECRET_KEY_BYTES, algorithm=ALGORITHM)
+
+def decode_access_token(token: str) -> dict:
+    """Verifikasi signature & exp token. Raise InvalidTokenError jika tidak valid."""
+    return jwt.decode(token, _SECRET_KEY_BYTES, algorithms=_DECODE_ALGORITHMS, options=_DECODE_OPTS)
+
+# Cache hasil verifikasi token: key = hash token (token mentah tidak disimpan),
+# value = (user_id, exp). Entri hidup maksimal 30 detik dan tidak melewati exp token.
+TOKEN_CACHE_TTL = 30  # detik
+
+def _token_ttu(_key, value, now):
+    return min(value[1], now + TOKEN_CACHE_TTL)
+
+_token_cache = TLRUCache(maxsize=10_000, ttu=_token_ttu, timer=time.time)
+_token_cache_lock = threading.Lock()
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
 
 def get_db():
     db = SessionLocal()
@@ -38,16 +129,40 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    key = _token_key(token)
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    if cached is not None:
+        # token sudah pernah diverifikasi → lewati decode & lookup username
+        user = db.get(User, cached[0])
+        if user:
+            return user
+        with _token_cache_lock:
+            _token_cache.pop(key, None)
+        raise HTTPException(status_code=401, detail="User not found")
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
+    except InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = db.query(User).filter(User.username == username).first()
+    user_id = payload.get("uid")
+    if user_id is not None:
+        # lookup PK (identity map); username tetap dicek agar id lama tidak salah orang
+        user = db.get(User, user_id)
+        if user and user.username != username:
+            user = None
+    else:
+        # token lama tanpa "uid"
+        user = db.query(User).filter(User.username == username).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    if "exp" in payload:
+        with _token_cache_lock:
+            _token_cache[key] = (user.id, payload["exp"])
     return user
 
 def require_role(*roles):
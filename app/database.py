@@ -1,15 +1,36 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./patients.db")
 
-# If using SQLite, need check_same_thread
-connect_args = {}
+# Ukuran pool bisa di-tuning per deployment lewat env
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+# Cache SQL hasil kompilasi (default SQLAlchemy 500); cukup untuk semua statement app
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+engine_kwargs = {"query_cache_size": DB_QUERY_CACHE_SIZE}
 if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+    # If using SQLite, need check_same_thread
+    engine_kwargs["connect_args"] = {"check_same_thread": False}
+    # SQLite in-memory: satu koneksi dipakai bersama agar datanya tidak hilang.
+    # SQLite file tetap pakai pool default (satu koneksi per thread/sesi).
+    if DATABASE_URL in ("sqlite://", "sqlite:///:memory:"):
+        engine_kwargs["poolclass"] = StaticPool
+else:
+    engine_kwargs.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
 
-engine = create_engine(DATABASE_URL, echo=False, connect_args=connect_args)
+engine = create_engine(DATABASE_URL, echo=False, **engine_kwargs)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -1,12 +1,23 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, ORJSONResponse, HTMLResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import logging
+import os
 from fastapi.responses import Response
 import base64
+from typing import Optional
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from .auth import (
+    BCRYPT_ROUNDS_FROM_ENV, calibrate_bcrypt_rounds, dummy_password_hash,
+    existing_usernames, get_password_hash,
+)
 from .database import Base, engine, SessionLocal
 from .models import User
+from .templates_engine import templates
 from .routers import patients as patients_router
 from .routers import auth as auth_router
 from .routers import dashboard as dashboard_router
@@ -16,7 +27,7 @@ from .routers import users as users_router
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("patients-app")
 
-app = FastAPI(title="Patients App")
+app = FastAPI(title="Patients App", default_response_class=ORJSONResponse)
 # Favicon kecil 1x1 (clear pixel) supaya browser tidak spam error
 _CLEAR_ICO = base64.b64decode(
     b'AAABAAEAEBAAAAAAIABoBAAAFgAAACgAAAAQAAAAIAAAAAEAGAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
@@ -26,41 +37,53 @@ _CLEAR_ICO = base64.b64decode(
     b'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
 )
 
+# Response dibuat sekali; Cache-Control supaya browser tidak meminta ulang
+_FAVICON_RESPONSE = Response(
+    content=_CLEAR_ICO,
+    media_type="image/x-icon",
+    headers={"Cache-Control": "public, max-age=31536000, immutable"},
+)
+
 @app.get("/favicon.ico")
 def favicon():
-    return Response(content=_CLEAR_ICO, media_type="image/x-icon")
+    return _FAVICON_RESPONSE
+_ERROR_TMPL = templates.get_template("error.html")
+
 def wants_html(request: Request) -> bool:
     accept = request.headers.get("accept", "")
     return "text/html" in accept.lower()
 
-def render_error_page(request: Request, status_code: int, message: str) -> HTMLResponse:
+def render_error_page(request: Request, status_code: int, message: str, html: Optional[bool] = None) -> HTMLResponse:
     # render template error.html jika user minta HTML, else JSON
-    if wants_html(request):
-        from .templates_engine import templates
-        return templates.TemplateResponse(
-            "error.html",
-            {"request": request, "status_code": status_code, "message": message},
+    # (html bisa dioper dari handler yang sudah mengecek Accept header)
+    if html is None:
+        html = wants_html(request)
+    if html:
+        return HTMLResponse(
+            _ERROR_TMPL.render({"request": request, "status_code": status_code, "message": message}),
             status_code=status_code,
         )
-    return JSONResponse(status_code=status_code, content={"detail": message})
+    return ORJSONResponse(status_code=status_code, content={"detail": message})
 
 # --- Exception Handlers ---
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
+    html = wants_html(request)
     # 401: redirect ke login untuk UX lebih baik (khusus permintaan HTML)
-    if exc.status_code == 401 and wants_html(request):
+    if exc.status_code == 401 and html:
         return RedirectResponse(url="/login", status_code=302)
     # lain-lain: render error page / JSON
-    return render_error_page(request, exc.status_code, str(exc.detail))
+    return render_error_page(request, exc.status_code, str(exc.detail), html=html)
 
 @app.exception_handler(StarletteHTTPException)
 async def starlette_http_exception_handler(request: Request, exc: StarletteHTTPException):
+    html = wants_html(request)
     # 401: redirect ke login (HTML)
-    if exc.status_code == 401 and wants_html(request):
+    if exc.status_code == 401 and html:
         return RedirectResponse(url="/login", status_code=302)
     # 404/403/dst
-    return render_error_page(request, exc.status_code, str(exc.detail))
+    return render_error_page(request, exc.status_code, str(exc.detail), html=html)
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -77,18 +100,51 @@ async def unhandled_exception_handler(request: Request, exc: Exception):
     return render_error_page(request, 500, msg)
 
 # --- Startup: create tables & seed user demo ---
+# Di produksi skema sebaiknya dikelola lewat migrasi; set AUTO_CREATE_TABLES=0 untuk mematikan create_all
+AUTO_CREATE_TABLES = os.getenv("AUTO_CREATE_TABLES", "1") == "1"
+
+SEED_USERS = [
+    ("admin", "admin123", "admin"),
+    ("dokter", "dokter123", "dokter"),
+]
+
+def _insert_users_ignore_existing():
+    """INSERT yang melewati username duplikat (ON CONFLICT DO NOTHING) jika dialek mendukung."""
+    if engine.dialect.name == "postgresql":
+        return pg_insert(User).on_conflict_do_nothing(index_elements=["username"])
+    if engine.dialect.name == "sqlite":
+        return sqlite_insert(User).on_conflict_do_nothing(index_elements=["username"])
+    return insert(User)
+
 @app.on_event("startup")
 def on_startup():
-    Base.metadata.create_all(bind=engine)
-    from sqlalchemy.orm import Session
-    from .auth import get_password_hash
+    if AUTO_CREATE_TABLES:
+        Base.metadata.create_all(bind=engine)
+        # create_all tidak menambah index ke tabel yang sudah ada → buat yang belum ada
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+    if not BCRYPT_ROUNDS_FROM_ENV:
+        log.info(
+            "bcrypt cost dikalibrasi: %d rounds (multi-worker: set BCRYPT_ROUNDS agar seragam)",
+            calibrate_bcrypt_rounds(),
+        )
+    # hash dummy untuk login user tak dikenal: dibuat sekarang (cost final), bukan di request pertama
+    dummy_password_hash()
     db: Session = SessionLocal()
     try:
-        if not db.query(User).filter(User.username == "admin").first():
-            db.add(User(username="admin", password_hash=get_password_hash("admin123"), role="admin"))
-        if not db.query(User).filter(User.username == "dokter").first():
-            db.add(User(username="dokter", password_hash=get_password_hash("dokter123"), role="dokter"))
-        db.commit()
+        # 1 query untuk cek semua seed, lalu 1 insert untuk yang belum ada.
+        # Hash hanya dihitung untuk user yang memang belum ada (bcrypt mahal).
+        existing = existing_usernames(db, (username for username, _, _ in SEED_USERS))
+        missing = [
+            {"username": username, "password_hash": get_password_hash(password), "role": role}
+            for username, password, role in SEED_USERS
+            if username not in existing
+        ]
+        if missing:
+            # ON CONFLICT DO NOTHING: aman saat beberapa worker start bersamaan
+            db.execute(_insert_users_ignore_existing(), missing)
+            db.commit()
     finally:
         db.close()
 
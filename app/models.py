@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, Text, func
+from sqlalchemy import Column, Integer, String, Date, Text, Index, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import DateTime
 from .database import Base
@@ -11,12 +11,18 @@ class User(Base):
     role = Column(String(20), nullable=False, default="admin")  # 'dokter' or 'admin'
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # daftar akun dokter: WHERE role = ... ORDER BY created_at DESC, id
+        # (urutan kunci = ORDER BY persis → index scan tanpa sort, juga di PostgreSQL)
+        Index("ix_users_role_created_id", role, created_at.desc(), id),
+    )
+
 class Patient(Base):
     __tablename__ = "patients"
     id = Column(Integer, primary_key=True, index=True)
     nama = Column(String(120), nullable=False)
     tanggal_lahir = Column(Date, nullable=True)
-    tanggal_kunjungan = Column(Date, nullable=False)
+    tanggal_kunjungan = Column(Date, nullable=False, index=True)  # filter rentang & urutan dashboard
     diagnosis = Column(Text, nullable=True)
     tindakan = Column(Text, nullable=True)
     dokter = Column(String(120), nullable=True)
@@ -1,44 +1,121 @@
+import asyncio
+import threading
+import time
+from typing import Optional
 from fastapi import APIRouter, Depends, Form, Request, Response, status
 from fastapi.responses import RedirectResponse, HTMLResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
+from cachetools import TTLCache
 
-from ..auth import get_db, verify_password, create_access_token
+from ..auth import (
+    get_db, verify_password, create_access_token, dummy_password_hash,
+    get_password_hash, password_needs_rehash,
+)
 from ..models import User
+from ..templates_engine import templates
 
 router = APIRouter()
 
+_LOGIN_TMPL = templates.get_template("login.html")
+
+def _render_login(request: Request, error: Optional[str] = None, status_code: int = 200) -> HTMLResponse:
+    return HTMLResponse(_LOGIN_TMPL.render({"request": request, "error": error}), status_code=status_code)
+
+# Batas login gagal per IP: bcrypt selalu dijalankan (lihat login), jadi
+# tanpa batas ini endpoint mudah dipakai untuk membakar CPU server.
+# Hanya percobaan gagal yang dihitung (staf di balik satu IP/NAT tidak ikut terblokir),
+# dengan jendela tetap: blokir berakhir 60 detik setelah kegagalan pertama di jendela itu.
+LOGIN_MAX_ATTEMPTS = 10
+LOGIN_WINDOW_SECONDS = 60
+# value = (awal jendela, jumlah gagal); TTLCache hanya untuk membuang entri lama
+_login_failures: TTLCache = TTLCache(maxsize=10_000, ttl=LOGIN_WINDOW_SECONDS)
+_login_failures_lock = threading.Lock()
+
+def _login_rate_limited(client_ip: str) -> bool:
+    """True jika IP sudah mencapai batas login gagal di jendela yang sedang berjalan."""
+    now = time.monotonic()
+    with _login_failures_lock:
+        entry = _login_failures.get(client_ip)
+    return entry is not None and now - entry[0] < LOGIN_WINDOW_SECONDS and entry[1] >= LOGIN_MAX_ATTEMPTS
+
+def _record_login_failure(client_ip: str) -> None:
+    """Catat satu login gagal. Jendela baru dimulai jika belum ada / sudah lewat 60 detik."""
+    now = time.monotonic()
+    with _login_failures_lock:
+        entry = _login_failures.get(client_ip)
+        if entry is None or now - entry[0] >= LOGIN_WINDOW_SECONDS:
+            _login_failures[client_ip] = (now, 1)
+        elif entry[1] < LOGIN_MAX_ATTEMPTS:
+            # sudah di batas → tidak ditulis ulang, jadi jendela (dan blokir) tidak diperpanjang
+            _login_failures[client_ip] = (entry[0], entry[1] + 1)
+
+def _find_user(db: Session, username: str) -> Optional[User]:
+    return db.query(User).filter(User.username == username).first()
+
+def _check_password(user: Optional[User], password: str) -> bool:
+    # Selalu jalankan bcrypt (pakai hash dummy jika user tidak ada) agar waktu
+    # respon tidak membocorkan apakah username terdaftar
+    return verify_password(password, user.password_hash if user else dummy_password_hash())
+
+def _update_password_hash(db: Session, user: User, password_hash: str) -> None:
+    try:
+        user.password_hash = password_hash
+        db.commit()
+    except SQLAlchemyError:
+        # gagal rehash tidak boleh menggagalkan login; dicoba lagi di login berikutnya
+        db.rollback()
+
 @router.get("/login", response_class=HTMLResponse)
 def login_form(request: Request):
-    from ..templates_engine import templates
-    return templates.TemplateResponse("login.html", {"request": request, "error": None})
+    return _render_login(request)
 
 @router.post("/login")
-def login(
+async def login(
     request: Request,
     response: Response,
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db),
 ):
-    from ..templates_engine import templates
+    client_ip = request.client.host if request.client else "unknown"
+    if _login_rate_limited(client_ip):
+        return _render_login(
+            request,
+            "Terlalu banyak percobaan login. Coba lagi dalam 1 menit.",
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+
     try:
-        user = db.query(User).filter(User.username == username).first()
+        user = await run_in_threadpool(_find_user, db, username)
     except SQLAlchemyError:
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Gagal mengakses database. Coba lagi."},
+        return _render_login(
+            request,
+            "Gagal mengakses database. Coba lagi.",
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
 
-    if not user or not verify_password(password, user.password_hash):
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Username atau password salah."},
+    # bcrypt (~100-300 ms) di thread terpisah: event loop & threadpool endpoint sync tetap bebas
+    password_ok = await asyncio.to_thread(_check_password, user, password)
+    if not user or not password_ok:
+        _record_login_failure(client_ip)
+        return _render_login(
+            request,
+            "Username atau password salah.",
             status_code=status.HTTP_400_BAD_REQUEST,
         )
 
-    token = create_access_token({"sub": user.username})
+    # dibaca sebelum rehash: commit meng-expire `user`, akses atribut sesudahnya = SELECT di event loop
+    user_name, user_id = user.username, user.id
+
+    # cost hash lama ≠ BCRYPT_ROUNDS → hash ulang dengan password yang baru diverifikasi,
+    # supaya semua hash tersimpan menyatu ke cost yang sama dengan hash dummy
+    if password_needs_rehash(user.password_hash):
+        new_hash = await asyncio.to_thread(get_password_hash, password)
+        await run_in_threadpool(_update_password_hash, db, user, new_hash)
+
+    token = create_access_token({"sub": user_name, "uid": user_id})
     resp = RedirectResponse(url="/dashboard", status_code=302)
     resp.set_cookie("access_token", token, httponly=True, samesite="lax")
     return resp
@@ -1,19 +1,27 @@
 from datetime import date, datetime
-from typing import Optional, List, Union, Tuple
+from typing import Any, Optional, List, Union, Tuple
 from fastapi import APIRouter, Depends, Request, Query, Body, HTTPException, status
 from fastapi.responses import HTMLResponse, StreamingResponse, RedirectResponse, JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import Date, Text, and_, func, insert, literal, null, select, type_coerce, union_all
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.expression import ColumnElement
 import io
-import json
+from collections import Counter
+import orjson
 import pandas as pd
+import xlsxwriter
 
-from ..auth import get_db, get_current_user
+from jwt import InvalidTokenError
+
+from ..auth import decode_access_token, get_db, get_current_user
 from ..models import Patient, User
+from ..templates_engine import templates
 
 router = APIRouter()
 
+_DASHBOARD_TMPL = templates.get_template("dashboard.html")
+
 def _parse_date_q(s: Optional[str]) -> Optional[date]:
     """Parse tanggal dari query (string). Kosong/invalid → None (supaya tidak 422)."""
     if not s:
@@ -24,22 +32,96 @@ def _parse_date_q(s: Optional[str]) -> Optional[date]:
     except ValueError:
         return None
 
+def _patient_filters(q: Optional[str], start: Optional[date], end: Optional[date]) -> List[ColumnElement[bool]]:
+    """Kondisi WHERE untuk filter nama / rentang tanggal kunjungan (kosong → tanpa filter)."""
+    filters: List[ColumnElement[bool]] = []
+    if q:
+        filters.append(Patient.nama.ilike(f"%{q}%"))
+    if start:
+        filters.append(Patient.tanggal_kunjungan >= start)
+    if end:
+        filters.append(Patient.tanggal_kunjungan <= end)
+    return filters
+
+# Di atas batas ini agregasi chart dihitung oleh DB, bukan dari baris yang sudah dimuat
+AGG_IN_PYTHON_MAX_ROWS = 5000
+
+def _aggregate_loaded(patients: List[Patient]):
+    """Hitung (per hari, diagnosis, tindakan) dari baris pasien yang sudah dimuat."""
+    visits = Counter(p.tanggal_kunjungan for p in patients)
+    diag = Counter(p.diagnosis for p in patients if p.diagnosis)
+    tind = Counter(p.tindakan for p in patients if p.tindakan)
+    return list(visits.items()), list(diag.items()), list(tind.items())
+
+def _aggregate_sql(db: Session, filters: List[ColumnElement[bool]]):
+    """
+    Versi DB untuk data besar. Satu round-trip: CTE data terfilter, lalu UNION ALL
+    dari group-by per hari, diagnosis, tindakan + total keseluruhan (tanpa filter).
+    Kolom "kind" jadi pembeda.
+    """
+    filtered = (
+        select(Patient.id, Patient.tanggal_kunjungan, Patient.diagnosis, Patient.tindakan)
+        .where(*filters)
+        .cte("filtered")
+    )
+    no_day = type_coerce(null(), Date)
+    no_label = type_coerce(null(), Text)
+    agg_stmt = union_all(
+        # 1) Jumlah pasien per hari (select pertama menentukan tipe kolom hasil)
+        select(literal("visit"), filtered.c.tanggal_kunjungan, no_label, func.count(filtered.c.id))
+        .group_by(filtered.c.tanggal_kunjungan),
+        # 2) Top Diagnosis
+        select(literal("diag"), no_day, filtered.c.diagnosis, func.count(filtered.c.id))
+        .where(and_(filtered.c.diagnosis.isnot(None), filtered.c.diagnosis != ""))
+        .group_by(filtered.c.diagnosis),
+        # 3) Top Tindakan
+        select(literal("tind"), no_day, filtered.c.tindakan, func.count(filtered.c.id))
+        .where(and_(filtered.c.tindakan.isnot(None), filtered.c.tindakan != ""))
+        .group_by(filtered.c.tindakan),
+        # 4) Total semua pasien
+        select(literal("total"), no_day, no_label, func.count(Patient.id)),
+    )
+
+    total = 0
+    visit_rows: List[Tuple[date, int]] = []
+    diag_rows: List[Tuple[Optional[str], int]] = []
+    tind_rows: List[Tuple[Optional[str], int]] = []
+    for kind, day, label, count in db.execute(agg_stmt).all():
+        if kind == "visit":
+            visit_rows.append((day, int(count)))
+        elif kind == "diag":
+            diag_rows.append((label, int(count)))
+        elif kind == "tind":
+            tind_rows.append((label, int(count)))
+        else:
+            total = int(count)
+    return total, visit_rows, diag_rows, tind_rows
+
+def _top_with_others(rows: List[Tuple[Optional[str], int]], top_n: int = 8) -> Tuple[List[str], List[int]]:
+    """Urutkan (label, jumlah) menurun, ambil top N, gabungkan sisanya ke "Lainnya"."""
+    rows = sorted(rows, key=lambda r: (-r[1], r[0] or ""))
+    labels = [label or "-" for label, _ in rows[:top_n]]
+    values = [c for _, c in rows[:top_n]]
+    others_sum = sum(c for _, c in rows[top_n:])
+    if others_sum:
+        labels.append("Lainnya")
+        values.append(others_sum)
+    return labels, values
+
 @router.get("/", include_in_schema=False)
-def root(request: Request, db: Session = Depends(get_db)):
+def root(request: Request):
     """Jika belum login → /login, jika sudah → /dashboard"""
-    from jose import JWTError, jwt
-    from ..auth import SECRET_KEY, ALGORITHM
     token = request.cookies.get("access_token")
     if not token:
         return RedirectResponse(url="/login", status_code=302)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username = payload.get("sub")
-    except JWTError:
+    except InvalidTokenError:
         return RedirectResponse(url="/login", status_code=302)
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    if not username:
         return RedirectResponse(url="/login", status_code=302)
+    # Tidak perlu cek user ke DB: /dashboard memvalidasi ulang lewat get_current_user
     return RedirectResponse(url="/dashboard", status_code=302)
 
 @router.get("/dashboard", response_class=HTMLResponse)
@@ -58,8 +140,6 @@ def dashboard(
     - Jika start > end → otomatis ditukar.
     - String kosong pada start/end diabaikan (tidak 422).
     """
-    from ..templates_engine import templates
-
     # Parse string → date (invalid/"" → None)
     s_start = _parse_date_q(start)
     s_end = _parse_date_q(end)
@@ -72,86 +152,40 @@ def dashboard(
     if eff_start and eff_end and eff_start > eff_end:
         eff_start, eff_end = eff_end, eff_start
 
-    # Base query + filter
-    try:
-        query = db.query(Patient)
-        if q:
-            query = query.filter(Patient.nama.ilike(f"%{q}%"))
-        if eff_start:
-            query = query.filter(Patient.tanggal_kunjungan >= eff_start)
-        if eff_end:
-            query = query.filter(Patient.tanggal_kunjungan <= eff_end)
-
-        patients = query.order_by(Patient.tanggal_kunjungan.desc()).all()
-        total = db.query(func.count(Patient.id)).scalar()
-    except SQLAlchemyError:
-        raise HTTPException(status_code=500, detail="Gagal memuat dashboard.")
+    # Filter dibangun sekali, dipakai untuk daftar pasien & agregasi chart
+    filters = _patient_filters(q, eff_start, eff_end)
 
-    # ---------- Aggregations untuk Chart ----------
-    def _apply_filters(qry):
-        if q:
-            qry = qry.filter(Patient.nama.ilike(f"%{q}%"))
-        if eff_start:
-            qry = qry.filter(Patient.tanggal_kunjungan >= eff_start)
-        if eff_end:
-            qry = qry.filter(Patient.tanggal_kunjungan <= eff_end)
-        return qry
-
-    # 1) Jumlah pasien per hari
+    # Base query + filter
     try:
-        rows: List[Tuple[date, int]] = (
-            _apply_filters(db.query(Patient.tanggal_kunjungan, func.count(Patient.id)))
-            .group_by(Patient.tanggal_kunjungan)
-            .order_by(Patient.tanggal_kunjungan.asc())
+        patients = (
+            db.query(Patient)
+            .filter(*filters)
+            .order_by(Patient.tanggal_kunjungan.desc())
             .all()
         )
-        visits_labels = [r[0].isoformat() for r in rows]
-        visits_values = [int(r[1]) for r in rows]
     except SQLAlchemyError:
-        visits_labels, visits_values = [], []
+        raise HTTPException(status_code=500, detail="Gagal memuat dashboard.")
 
-    # 2) Top Diagnosis
+    # ---------- Aggregations untuk Chart ----------
+    # Query agregasi/COUNT gagal → chart kosong & total dari daftar, halaman tetap tampil
+    visit_rows, diag_rows, tind_rows = [], [], []
+    total = len(patients)
     try:
-        diag_rows: List[Tuple[Optional[str], int]] = (
-            _apply_filters(
-                db.query(Patient.diagnosis, func.count(Patient.id))
-                .filter(and_(Patient.diagnosis.isnot(None), Patient.diagnosis != ""))
-            )
-            .group_by(Patient.diagnosis)
-            .order_by(func.count(Patient.id).desc())
-            .all()
-        )
-        # Ambil top 8, gabungkan sisanya ke "Lainnya"
-        top_n = 8
-        diag_labels = [d or "-" for d, _ in diag_rows[:top_n]]
-        diag_values = [int(c) for _, c in diag_rows[:top_n]]
-        others_sum = sum(int(c) for _, c in diag_rows[top_n:])
-        if others_sum:
-            diag_labels.append("Lainnya")
-            diag_values.append(others_sum)
+        if len(patients) <= AGG_IN_PYTHON_MAX_ROWS:
+            # Baris sudah ada di memori → hitung langsung, tanpa GROUP BY tambahan
+            visit_rows, diag_rows, tind_rows = _aggregate_loaded(patients)
+            if filters:
+                total = db.query(func.count(Patient.id)).scalar()
+        else:
+            total, visit_rows, diag_rows, tind_rows = _aggregate_sql(db, filters)
     except SQLAlchemyError:
-        diag_labels, diag_values = [], []
+        pass
 
-    # 3) Top Tindakan
-    try:
-        tind_rows: List[Tuple[Optional[str], int]] = (
-            _apply_filters(
-                db.query(Patient.tindakan, func.count(Patient.id))
-                .filter(and_(Patient.tindakan.isnot(None), Patient.tindakan != ""))
-            )
-            .group_by(Patient.tindakan)
-            .order_by(func.count(Patient.id).desc())
-            .all()
-        )
-        top_n = 8
-        tind_labels = [t or "-" for t, _ in tind_rows[:top_n]]
-        tind_values = [int(c) for _, c in tind_rows[:top_n]]
-        others_sum = sum(int(c) for _, c in tind_rows[top_n:])
-        if others_sum:
-            tind_labels.append("Lainnya")
-            tind_values.append(others_sum)
-    except SQLAlchemyError:
-        tind_labels, tind_values = [], []
+    visit_rows.sort(key=lambda r: r[0])
+    visits_labels = [d.isoformat() for d, _ in visit_rows]
+    visits_values = [c for _, c in visit_rows]
+    diag_labels, diag_values = _top_with_others(diag_rows)
+    tind_labels, tind_values = _top_with_others(tind_rows)
 
     # Kirim data chart sebagai JSON string agar aman di JS
     ctx = {
@@ -162,15 +196,26 @@ def dashboard(
         "q": q or "",
         "start": eff_start.isoformat() if eff_start else "",
         "end": eff_end.isoformat() if eff_end else "",
-        "visits_labels": json.dumps(visits_labels),
-        "visits_values": json.dumps(visits_values),
-        "diag_labels": json.dumps(diag_labels),
-        "diag_values": json.dumps(diag_values),
-        "tind_labels": json.dumps(tind_labels),
-        "tind_values": json.dumps(tind_values),
+        "visits_labels": orjson.dumps(visits_labels).decode(),
+        "visits_values": orjson.dumps(visits_values).decode(),
+        "diag_labels": orjson.dumps(diag_labels).decode(),
+        "diag_values": orjson.dumps(diag_values).decode(),
+        "tind_labels": orjson.dumps(tind_labels).decode(),
+        "tind_values": orjson.dumps(tind_values).decode(),
     }
 
-    return templates.TemplateResponse("dashboard.html", ctx)
+    return HTMLResponse(_DASHBOARD_TMPL.render(ctx))
+
+EXPORT_COLUMNS = ("ID", "Nama", "Tanggal Lahir", "Tanggal Kunjungan", "Diagnosis", "Tindakan", "Dokter")
+
+def _parse_iso_dates(values: List[Any]) -> List[Optional[date]]:
+    """Parse sekaligus nilai 'YYYY-MM-DD' (opsional diikuti jam) via pandas; nilai lain → None."""
+    heads = [
+        v[:10] if isinstance(v, str) and (len(v) == 10 or v[10:11] in ("T", " ")) else None
+        for v in values
+    ]
+    parsed = pd.to_datetime(pd.Series(heads, dtype="object"), format="%Y-%m-%d", errors="coerce")
+    return [None if pd.isna(ts) else ts.date() for ts in parsed]
 
 @router.get("/export.xlsx")
 def export_excel(
@@ -198,33 +243,40 @@ def export_excel(
         eff_start, eff_end = eff_end, eff_start
 
     try:
-        query = db.query(Patient)
-        if q:
-            query = query.filter(Patient.nama.ilike(f"%{q}%"))
-        if eff_start:
-            query = query.filter(Patient.tanggal_kunjungan >= eff_start)
-        if eff_end:
-            query = query.filter(Patient.tanggal_kunjungan <= eff_end)
-        rows = query.all()
+        query = db.query(Patient).filter(*_patient_filters(q, eff_start, eff_end))
+        # Stream per 500 baris (server-side cursor) alih-alih memuat semua ke memori
+        rows = query.execution_options(stream_results=True).yield_per(500)
     except SQLAlchemyError:
         raise HTTPException(status_code=500, detail="Gagal mengambil data untuk export.")
 
-    data = [{
-        "ID": r.id,
-        "Nama": r.nama,
-        "Tanggal Lahir": r.tanggal_lahir.isoformat() if r.tanggal_lahir else None,
-        "Tanggal Kunjungan": r.tanggal_kunjungan.isoformat() if r.tanggal_kunjungan else None,
-        "Diagnosis": r.diagnosis,
-        "Tindakan": r.tindakan,
-        "Dokter": r.dokter,
-    } for r in rows]
-
     output = io.BytesIO()
     try:
-        df = pd.DataFrame(data)
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Pasien")
+        # constant_memory: baris langsung di-flush ke file sementara, tidak ditahan sebagai objek Cell.
+        # strings_to_urls/formulas=False: teks pasien ditulis apa adanya (seperti openpyxl),
+        # bukan jadi hyperlink/formula — URL > 2079 karakter akan hilang tanpa error.
+        workbook = xlsxwriter.Workbook(
+            output,
+            {"constant_memory": True, "strings_to_urls": False, "strings_to_formulas": False},
+        )
+        try:
+            sheet = workbook.add_worksheet("Pasien")
+            sheet.write_row(0, 0, EXPORT_COLUMNS, workbook.add_format({"bold": True}))
+            for row_idx, r in enumerate(rows, start=1):
+                sheet.write_row(row_idx, 0, (
+                    r.id,
+                    r.nama,
+                    r.tanggal_lahir.isoformat() if r.tanggal_lahir else None,
+                    r.tanggal_kunjungan.isoformat() if r.tanggal_kunjungan else None,
+                    r.diagnosis,
+                    r.tindakan,
+                    r.dokter,
+                ))
+        finally:
+            # juga di jalur error: close() membersihkan file sementara constant_memory
+            workbook.close()
         output.seek(0)
+    except SQLAlchemyError:
+        raise HTTPException(status_code=500, detail="Gagal mengambil data untuk export.")
     except Exception:
         raise HTTPException(status_code=500, detail="Gagal membuat file Excel.")
 
@@ -256,10 +308,11 @@ def import_patients(
             content={"detail": f"Maksimal {MAX_ITEMS} item per import."},
         )
 
-    created = 0
+    mappings: list[dict] = []
     errors: list[dict] = []
 
     def to_date(val):
+        # Dipanggil hanya untuk nilai yang ditolak _parse_iso_dates (format lain / invalid)
         if val is None or val == "":
             return None
         try:
@@ -267,31 +320,47 @@ def import_patients(
         except Exception:
             raise ValueError(f"Format tanggal tidak valid: {val}")
 
+    # Pass 1: validasi field non-tanggal, kumpulkan nilai tanggal mentah
+    pending: list[tuple] = []
+    for idx, item in enumerate(items):
+        try:
+            nama = (item.get("nama") or item.get("name") or "").strip()
+            tgl_raw = item.get("tanggal_kunjungan") or item.get("visit_date")
+            if not nama or not tgl_raw:
+                raise ValueError("Field minimal 'nama' dan 'tanggal_kunjungan/visit_date' wajib.")
+            pending.append((idx, item, nama, tgl_raw, item.get("tanggal_lahir")))
+        except Exception as e:
+            errors.append({"index": idx, "error": str(e), "item": item})
+
+    # Tanggal ISO di-parse sekaligus (vectorized); sisanya (format lain/invalid) lewat to_date
+    visit_dates = _parse_iso_dates([p[3] for p in pending])
+    birth_dates = _parse_iso_dates([p[4] for p in pending])
+
+    # Pass 2: susun baris; insert dilakukan sekali (multi-row) setelah loop
+    for (idx, item, nama, tgl_raw, lahir_raw), tgl_kunjungan, tgl_lahir in zip(pending, visit_dates, birth_dates):
+        try:
+            mappings.append({
+                "nama": nama,
+                "tanggal_kunjungan": tgl_kunjungan if tgl_kunjungan is not None else to_date(tgl_raw),
+                "tanggal_lahir": tgl_lahir if tgl_lahir is not None else to_date(lahir_raw),
+                "diagnosis": (item.get("diagnosis") or None),
+                "tindakan": (item.get("tindakan") or None),
+                "dokter": (item.get("dokter") or None),
+            })
+        except Exception as e:
+            errors.append({"index": idx, "error": str(e), "item": item})
+    errors.sort(key=lambda e: e["index"])
+
     try:
-        for idx, item in enumerate(items):
-            try:
-                nama = (item.get("nama") or item.get("name") or "").strip()
-                tgl_raw = item.get("tanggal_kunjungan") or item.get("visit_date")
-                if not nama or not tgl_raw:
-                    raise ValueError("Field minimal 'nama' dan 'tanggal_kunjungan/visit_date' wajib.")
-
-                p = Patient(
-                    nama=nama,
-                    tanggal_kunjungan=to_date(tgl_raw),
-                    tanggal_lahir=to_date(item.get("tanggal_lahir")),
-                    diagnosis=(item.get("diagnosis") or None),
-                    tindakan=(item.get("tindakan") or None),
-                    dokter=(item.get("dokter") or None),
-                )
-                db.add(p)
-                created += 1
-            except Exception as e:
-                errors.append({"index": idx, "error": str(e), "item": item})
+        if mappings:
+            db.execute(insert(Patient), mappings)
         db.commit()
     except SQLAlchemyError:
         db.rollback()
         raise HTTPException(status_code=500, detail="Gagal menyimpan data import ke database.")
 
+    created = len(mappings)
+
     status_code = 200 if created and not errors else 207
     return JSONResponse(
         status_code=status_code,
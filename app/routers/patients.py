@@ -1,21 +1,46 @@
+import threading
 from datetime import date, datetime
 from typing import Optional, Dict, Any, List
-from fastapi import APIRouter, Depends, Request, Form, HTTPException, status
+from fastapi import APIRouter, Depends, Request, Form, HTTPException, Query, status
 from fastapi.responses import RedirectResponse, HTMLResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
+from cachetools import TTLCache, cached
 
 from ..auth import get_db, get_current_user, require_role
 from ..models import Patient, User
+from ..templates_engine import templates
 
 router = APIRouter(prefix="/patients")
 
+PAGE_SIZE = 50
+
+_PATIENT_FORM_TMPL = templates.get_template("patient_form.html")
+_PATIENTS_LIST_TMPL = templates.get_template("patients_list.html")
+
+# Daftar dokter jarang berubah → cache 60 detik, di-reset saat akun dokter dibuat
+_doctor_cache: TTLCache = TTLCache(maxsize=1, ttl=60)
+_doctor_cache_lock = threading.Lock()
+
+def invalidate_doctor_cache() -> None:
+    """Kosongkan cache daftar dokter (panggil setelah mengubah user role 'dokter')."""
+    with _doctor_cache_lock:
+        _doctor_cache.clear()
+
+@cached(_doctor_cache, key=lambda db: 0, lock=_doctor_cache_lock)
 def _doctor_choices(db: Session) -> List[str]:
     """Ambil daftar username semua user dengan role 'dokter'."""
     rows = db.query(User).filter(User.role == "dokter").order_by(User.username.asc()).all()
     # fallback: kalau kosong (mustahil di produksi), jangan bikin dropdown kosong
     return [u.username for u in rows] or []
 
+def _doctor_options(db: Session, user: User) -> List[str]:
+    """Pilihan dokter untuk form (dari cache); user saat ini selalu ikut agar dropdown tidak kosong."""
+    doctors = _doctor_choices(db)
+    if user.username not in doctors:
+        doctors = [user.username] + doctors
+    return doctors
+
 def _render_form(
     request: Request,
     user: User,
@@ -26,17 +51,15 @@ def _render_form(
     status_code: int = 200,
 ) -> HTMLResponse:
     """Render ulang form dengan nilai terakhir & pesan error per-field + daftar dokter."""
-    from ..templates_engine import templates
-    return templates.TemplateResponse(
-        "patient_form.html",
-        {
+    return HTMLResponse(
+        _PATIENT_FORM_TMPL.render({
             "request": request,
             "patient": patient,
             "user": user,
             "form": form or {},
             "errors": errors or {},
             "doctors": doctors or [],
-        },
+        }),
         status_code=status_code,
     )
 
@@ -55,15 +78,28 @@ def _parse_date(s: Optional[str], field: str, errors: Dict[str, str], required:
 @router.get("", response_class=HTMLResponse)
 def list_patients(
     request: Request,
+    page: int = Query(1, description="Nomor halaman (mulai 1)"),
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    from ..templates_engine import templates
+    page = max(page, 1)
     try:
-        patients = db.query(Patient).order_by(Patient.tanggal_kunjungan.desc()).all()
+        # ambil 1 baris ekstra untuk tahu apakah masih ada halaman berikutnya (tanpa COUNT)
+        patients = (
+            db.query(Patient)
+            .order_by(Patient.tanggal_kunjungan.desc(), Patient.id.desc())
+            .limit(PAGE_SIZE + 1)
+            .offset((page - 1) * PAGE_SIZE)
+            .all()
+        )
     except SQLAlchemyError:
         raise HTTPException(status_code=500, detail="Gagal mengambil data pasien.")
-    return templates.TemplateResponse("patients_list.html", {"request": request, "patients": patients, "user": user})
+    has_next = len(patients) > PAGE_SIZE
+    return HTMLResponse(
+        _PATIENTS_LIST_TMPL.render(
+            {"request": request, "patients": patients[:PAGE_SIZE], "user": user, "page": page, "has_next": has_next}
+        )
+    )
 
 @router.get("/new", response_class=HTMLResponse)
 def new_patient_form(
@@ -71,10 +107,7 @@ def new_patient_form(
     db: Session = Depends(get_db),
     user: User = Depends(require_role("dokter")),
 ):
-    doctors = _doctor_choices(db)
-    # jika daftar dokter kosong, set minimal ke user saat ini agar tidak kosong
-    if user.username not in doctors:
-        doctors = [user.username] + doctors
+    doctors = _doctor_options(db, user)
     return _render_form(request, user=user, patient=None, form={}, errors={}, doctors=doctors)
 
 @router.post("/new")
@@ -89,9 +122,7 @@ def create_patient(
     db: Session = Depends(get_db),
     user: User = Depends(require_role("dokter"))
 ):
-    doctors = _doctor_choices(db)
-    if user.username not in doctors:
-        doctors = [user.username] + doctors
+    doctors = _doctor_options(db, user)
 
     errors: Dict[str, str] = {}
     form_values = {
@@ -150,9 +181,7 @@ def edit_patient_form(
     p = db.get(Patient, patient_id)
     if not p:
         raise HTTPException(status_code=404, detail="Data pasien tidak ditemukan.")
-    doctors = _doctor_choices(db)
-    if user.username not in doctors:
-        doctors = [user.username] + doctors
+    doctors = _doctor_options(db, user)
     return _render_form(request, user=user, patient=p, form={}, errors={}, doctors=doctors)
 
 @router.post("/{patient_id}/edit")
@@ -171,9 +200,7 @@ def update_patient(
     if not p:
         raise HTTPException(status_code=404, detail="Data pasien tidak ditemukan.")
 
-    doctors = _doctor_choices(db)
-    if user.username not in doctors:
-        doctors = [user.username] + doctors
+    doctors = _doctor_options(db, user)
 
     errors: Dict[str, str] = {}
     form_values = {
@@ -1,40 +1,132 @@
 # app/routers/users.py
-from fastapi import APIRouter, Depends, Request, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+import asyncio
+import hashlib
+import hmac
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, Body, Depends, Request, Form, Query, status
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from cachetools import TTLCache
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
-from typing import Dict, Any
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from pydantic import BaseModel, StringConstraints, ValidationError, model_validator
+from typing import Annotated, Dict, Any, List, Set
 
-from ..auth import get_db, get_current_user, require_role, get_password_hash
+from ..auth import get_db, get_current_user, require_role, get_password_hash, existing_usernames
 from ..models import User
+from ..templates_engine import templates
+from .patients import invalidate_doctor_cache
 
 router = APIRouter(prefix="/users")
 
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+BULK_MAX_ITEMS = 100
+# Hash bulk memakai executor sendiri (bukan default executor yang dipakai bcrypt /login),
+# jadi satu request bulk maksimal memakai 2 thread dan tidak mengantrikan login.
+BULK_HASH_WORKERS = 2
+_bulk_hash_executor = ThreadPoolExecutor(max_workers=BULK_HASH_WORKERS, thread_name_prefix="bulk-hash")
+
+# Hash dari percobaan yang gagal karena username bentrok; admin biasanya kirim ulang
+# dengan password yang sama (hanya ganti username) → pakai ulang, tanpa bcrypt lagi.
+_retry_hash_cache: TTLCache = TTLCache(maxsize=256, ttl=300)
+_retry_hash_lock = threading.Lock()
+# Key HMAC acak per proses: key cache tidak bisa di-brute-force seperti sha256 polos
+_RETRY_SECRET = secrets.token_bytes(32)
+
+def _retry_key(admin_id: int, password: str) -> bytes:
+    return hmac.new(_RETRY_SECRET, f"{admin_id}:{password}".encode(), hashlib.sha256).digest()
+
+# Template di-resolve & di-compile sekali saat import
+_USER_FORM_TMPL = templates.get_template("user_form.html")
+_USERS_LIST_TMPL = templates.get_template("users_list.html")
+
+class UserCredentials(BaseModel):
+    """Aturan minimal akun dokter (dipakai form tunggal & bulk), divalidasi pydantic-core."""
+    username: Annotated[str, StringConstraints(strip_whitespace=True, min_length=3)]
+    password: Annotated[str, StringConstraints(min_length=6)]
+
+class NewUserForm(UserCredentials):
+    password2: str
+
+    @model_validator(mode="after")
+    def _passwords_match(self) -> "NewUserForm":
+        # constant-time; bandingkan bytes karena compare_digest menolak str non-ASCII
+        if not hmac.compare_digest(self.password.encode(), self.password2.encode()):
+            raise ValueError("password mismatch")
+        return self
+
+    @classmethod
+    def as_form(
+        cls,
+        username: str = Form(""),
+        password: str = Form(""),
+        password2: str = Form(""),
+    ) -> Dict[str, str]:
+        """Field form mentah; validasi dilakukan handler agar error bisa dirender ulang di form."""
+        return {"username": username, "password": password, "password2": password2}
+
+def _validation_errors(exc: ValidationError) -> Dict[str, str]:
+    """Ubah error pydantic menjadi pesan per-field untuk form/JSON."""
+    errors: Dict[str, str] = {}
+    for err in exc.errors():
+        field = err["loc"][0] if err["loc"] else "password2"
+        raw = err.get("input")
+        if field == "password2":
+            msg = "Konfirmasi password tidak sama."
+        elif err["type"] == "missing" or raw is None or (isinstance(raw, str) and not raw.strip()):
+            msg = f"{str(field).capitalize()} wajib diisi."
+        elif err["type"] == "string_too_short":
+            msg = f"Minimal {err['ctx']['min_length']} karakter."
+        else:
+            msg = "Harus berupa teks."
+        errors.setdefault(str(field), msg)
+    return errors
+
 def _render_form(request: Request, user: User, form: Dict[str, Any], errors: Dict[str, str], status_code: int = 200):
-    from ..templates_engine import templates
-    return templates.TemplateResponse(
-        "user_form.html",
-        {"request": request, "user": user, "form": form, "errors": errors},
+    return HTMLResponse(
+        _USER_FORM_TMPL.render({"request": request, "user": user, "form": form, "errors": errors}),
         status_code=status_code,
     )
 
 @router.get("", response_class=HTMLResponse)
 def list_doctors(
     request: Request,
+    page: int = Query(1, description="Nomor halaman (mulai 1)"),
+    size: int = Query(PAGE_SIZE, description="Jumlah akun per halaman"),
+    created: bool = Query(False, description="Tampilkan banner sukses (?created=1)"),
     db: Session = Depends(get_db),
     admin: User = Depends(require_role("admin")),
 ):
-    """Daftar akun role=dokter (hanya admin)."""
-    from ..templates_engine import templates
+    """Daftar akun role=dokter (hanya admin), per halaman."""
+    page = max(page, 1)
+    size = min(max(size, 1), MAX_PAGE_SIZE)
     try:
-        doctors = db.query(User).filter(User.role == "dokter").order_by(User.created_at.desc()).all()
+        # hanya kolom yang ditampilkan (Row), tanpa hidrasi objek User;
+        # ambil 1 baris ekstra untuk tahu apakah masih ada halaman berikutnya
+        doctors = db.execute(
+            select(User.id, User.username, User.created_at)
+            .where(User.role == "dokter")
+            .order_by(User.created_at.desc(), User.id)
+            .limit(size + 1)
+            .offset((page - 1) * size)
+        ).all()
     except SQLAlchemyError:
         doctors = []
-    # tampilkan banner sukses jika ?created=1
-    created = request.query_params.get("created") == "1"
-    return templates.TemplateResponse(
-        "users_list.html",
-        {"request": request, "user": admin, "doctors": doctors, "created": created},
+    has_next = len(doctors) > size
+    return HTMLResponse(
+        _USERS_LIST_TMPL.render({
+            "request": request,
+            "user": admin,
+            "doctors": doctors[:size],
+            "created": created,
+            "page": page,
+            "size": size,
+            "has_next": has_next,
+        })
     )
 
 @router.get("/new", response_class=HTMLResponse)
@@ -49,57 +141,140 @@ def new_user_form(
         errors={}
     )
 
+def _insert_doctor(db: Session, username: str, password_hash: str) -> None:
+    try:
+        # Core insert: tanpa unit-of-work / identity map untuk satu baris
+        db.execute(insert(User).values(username=username, password_hash=password_hash, role="dokter"))
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+
 @router.post("/new")
-def create_user(
+async def create_user(
     request: Request,
-    username: str = Form(...),
-    password: str = Form(...),
-    password2: str = Form(...),
+    raw: Dict[str, str] = Depends(NewUserForm.as_form),
     db: Session = Depends(get_db),
     admin: User = Depends(require_role("admin")),
 ):
     """Buat akun role=dokter (hanya admin)."""
-    form = {
-        "username": (username or "").strip(),
-        "password": password or "",
-        "password2": password2 or "",
-    }
+    form = {**raw, "username": raw["username"].strip()}
+    try:
+        data = NewUserForm.model_validate(raw)
+    except ValidationError as exc:
+        errors = _validation_errors(exc)
+        return _render_form(request, user=admin, form=form, errors=errors, status_code=status.HTTP_400_BAD_REQUEST)
+    u, p = data.username, data.password
     errors: Dict[str, str] = {}
 
-    # Validasi sederhana
-    if not form["username"]:
-        errors["username"] = "Username wajib diisi."
-    elif len(form["username"]) < 3:
-        errors["username"] = "Minimal 3 karakter."
-
-    if not form["password"]:
-        errors["password"] = "Password wajib diisi."
-    elif len(form["password"]) < 6:
-        errors["password"] = "Minimal 6 karakter."
+    # Hash bcrypt (puluhan-ratusan ms) di thread terpisah agar event loop tidak terblokir;
+    # hanya setelah validasi lolos, dan tidak diulang jika hash percobaan sebelumnya masih ada
+    retry_key = _retry_key(admin.id, p)
+    with _retry_hash_lock:
+        password_hash = _retry_hash_cache.pop(retry_key, None)
+    if password_hash is None:
+        password_hash = await asyncio.to_thread(get_password_hash, p)
 
-    if form["password2"] != form["password"]:
-        errors["password2"] = "Konfirmasi password tidak sama."
+    # Simpan (duplikasi username ditangkap oleh UNIQUE index → atomik, tanpa SELECT cek dulu)
+    try:
+        await run_in_threadpool(_insert_doctor, db, u, password_hash)
+    except IntegrityError:
+        with _retry_hash_lock:
+            _retry_hash_cache[retry_key] = password_hash
+        errors["username"] = "Username sudah dipakai."
+        status_code = status.HTTP_400_BAD_REQUEST
+    except SQLAlchemyError:
+        errors["__all__"] = "Gagal membuat akun. Coba lagi."
+        status_code = 500
+    else:
+        invalidate_doctor_cache()
+        return RedirectResponse(url="/users?created=1", status_code=302)
 
-    # Cek duplikasi username
-    if not errors:
-        if db.query(User).filter(User.username == form["username"]).first():
-            errors["username"] = "Username sudah dipakai."
+    # rollback meng-expire `admin` → template memicu SELECT refresh; render di threadpool, bukan di event loop
+    return await run_in_threadpool(
+        _render_form, request, user=admin, form=form, errors=errors, status_code=status_code
+    )
 
-    if errors:
-        return _render_form(request, user=admin, form=form, errors=errors, status_code=status.HTTP_400_BAD_REQUEST)
 
-    # Simpan
+def _insert_doctors(db: Session, rows: List[Dict[str, str]]) -> None:
     try:
-        u = User(
-            username=form["username"],
-            password_hash=get_password_hash(form["password"]),
-            role="dokter",
-        )
-        db.add(u)
+        # satu INSERT multi-row untuk semua akun
+        db.execute(insert(User), rows)
         db.commit()
     except SQLAlchemyError:
         db.rollback()
-        errors["__all__"] = "Gagal membuat akun. Coba lagi."
-        return _render_form(request, user=admin, form=form, errors=errors, status_code=500)
+        raise
+
+@router.post("/bulk")
+async def create_users_bulk(
+    payload: List[dict] = Body(..., description='List akun: [{"username": ..., "password": ...}]'),
+    db: Session = Depends(get_db),
+    admin: User = Depends(require_role("admin")),
+):
+    """
+    Buat banyak akun role=dokter sekaligus (hanya admin).
+    - Validasi sama dengan form tunggal; username duplikat (di batch / di DB) ditolak per item.
+    - Hash password berjalan paralel di thread pool, lalu satu INSERT multi-row.
+    - Hasil: ringkasan sukses & error per indeks (password tidak ikut dikembalikan).
+    """
+    if len(payload) > BULK_MAX_ITEMS:
+        return JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={"detail": f"Maksimal {BULK_MAX_ITEMS} akun per permintaan."},
+        )
 
-    return RedirectResponse(url="/users?created=1", status_code=302)
+    errors: list[dict] = []
+    valid: list[tuple] = []  # (index, username, password)
+    seen: Set[str] = set()
+    for idx, item in enumerate(payload):
+        username = str(item.get("username") or "").strip()
+        try:
+            creds = UserCredentials.model_validate(item)
+        except ValidationError as exc:
+            errors.append({"index": idx, "username": username, "errors": _validation_errors(exc)})
+            continue
+        if creds.username in seen:
+            errors.append({"index": idx, "username": username, "errors": {"username": "Username duplikat dalam batch."}})
+            continue
+        seen.add(creds.username)
+        valid.append((idx, creds.username, creds.password))
+
+    try:
+        taken = await run_in_threadpool(existing_usernames, db, [u for _, u, _ in valid])
+    except SQLAlchemyError:
+        return JSONResponse(status_code=500, content={"detail": "Gagal mengakses database."})
+    for idx, username, _ in valid:
+        if username in taken:
+            errors.append({"index": idx, "username": username, "errors": {"username": "Username sudah dipakai."}})
+    valid = [v for v in valid if v[1] not in taken]
+
+    # bcrypt melepas GIL → hash paralel, dibatasi BULK_HASH_WORKERS thread khusus
+    loop = asyncio.get_running_loop()
+    hashes = await asyncio.gather(
+        *(loop.run_in_executor(_bulk_hash_executor, get_password_hash, p) for _, _, p in valid)
+    )
+    rows = [
+        {"username": username, "password_hash": password_hash, "role": "dokter"}
+        for (_, username, _), password_hash in zip(valid, hashes)
+    ]
+
+    if rows:
+        try:
+            await run_in_threadpool(_insert_doctors, db, rows)
+        except IntegrityError:
+            # username keburu dipakai request lain di antara cek & insert
+            return JSONResponse(
+                status_code=status.HTTP_409_CONFLICT,
+                content={"detail": "Sebagian username baru saja dipakai. Coba kirim ulang."},
+            )
+        except SQLAlchemyError:
+            return JSONResponse(status_code=500, content={"detail": "Gagal menyimpan akun ke database."})
+        invalidate_doctor_cache()
+
+    errors.sort(key=lambda e: e["index"])
+    created = len(rows)
+    status_code = 200 if created and not errors else 207
+    return JSONResponse(
+        status_code=status_code,
+        content={"status": "ok", "created": created, "failed": len(errors), "errors": errors},
+    )
@@ -1,2 +1,4 @@
+from pathlib import Path
 from fastapi.templating import Jinja2Templates
-templates = Jinja2Templates(directory="app/templates")
+# path absolut supaya template tetap ketemu walau app dijalankan dari direktori lain
+templates = Jinja2Templates(directory=str(Path(__file__).resolve().parent / "templates"))